@@ -0,0 +1,9 @@
+"""Optional Numba JIT - falls back to plain Python when numba is missing"""
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
@@ -1,21 +1,26 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
+import asyncio
 import threading
+import queue
 import time
+from collections import deque
+from itertools import islice
+import numpy as np
 from datetime import datetime
-import pandas as pd
 
 from config import get_config, update_environment, RISK_PARAMS, TRADING_PARAMS, ENVIRONMENT_MODE
 from delta_exchange_client import DeltaExchangeClient
 from smc_strategy import SMCStrategy
 from ml_model import MLModel
+from candle_buffer import CandleBuffer
 
 app = Flask(__name__)
 CORS(app)
 
 # Initialize components
 delta_client = DeltaExchangeClient()
-ml_model = MLModel()
+ml_model = MLModel(max_batch=len(TRADING_PARAMS['symbols']))
 smc_strategy = SMCStrategy(RISK_PARAMS)
 
 # Global bot state
@@ -24,134 +29,285 @@ bot_state = {
     'environment': ENVIRONMENT_MODE,
     'account_balance': 10000.0,
     'open_trades': [],
-    'closed_trades': [],
+    'closed_trades': deque(maxlen=500),
     'total_pnl': 0.0,
     'win_count': 0,
     'loss_count': 0,
     'last_update': datetime.now().isoformat()
 }
 
+# Writers swap in new list instances under the lock; readers take a
+# reference (or a bounded copy) under the lock and serialize outside it
+state_lock = threading.RLock()
+
 # Trading loop control
 trading_thread = None
+stream_thread = None
 stop_trading = threading.Event()
 
+# Market data: rolling OHLCV window per symbol, fed by the candle stream
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+BAR_HISTORY = 200
+ohlcv_buffers = {symbol: CandleBuffer(BAR_HISTORY) for symbol in TRADING_PARAMS['symbols']}
+bar_queue = queue.Queue()
+
+# Open time of the last bar evaluated per symbol
+last_bar_ts = {}
+
+async def seed_symbol(symbol, buffer):
+    """Backfill one symbol's candle buffer from REST history"""
+    try:
+        candles = await delta_client.fetch_candles_async(
+            symbol,
+            resolution=TRADING_PARAMS['timeframe'].replace('m', ''),
+            limit=BAR_HISTORY
+        )
+        if not candles:
+            return
+
+        for candle in sorted(candles, key=lambda c: c['time']):
+            buffer.append(int(candle['time']), [float(candle[col]) for col in PRICE_COLUMNS])
+    except Exception as e:
+        print(f"Error seeding candles for {symbol}: {e}")
+
+async def seed_buffers():
+    """Rebuild the candle buffers for the current symbols concurrently from REST history"""
+    global ohlcv_buffers
+
+    buffers = {symbol: CandleBuffer(BAR_HISTORY) for symbol in TRADING_PARAMS['symbols']}
+    try:
+        await asyncio.gather(*(seed_symbol(symbol, buffer) for symbol, buffer in buffers.items()))
+    finally:
+        await delta_client.close_async()
+
+    ohlcv_buffers = buffers
+
+def reseed_buffers():
+    """Stream (re)connected - backfill so buffers have no gap or stale partial bar"""
+    asyncio.run(seed_buffers())
+
+def on_candle(data):
+    """WebSocket callback - update the symbol's buffer and queue closed bars"""
+    buffer = ohlcv_buffers.get(data.get('symbol'))
+    if buffer is None:
+        return
+
+    # candle_start_time is in microseconds, REST history in seconds
+    start_time = int(data['candle_start_time']) // 1_000_000
+    row = [float(data[col]) for col in PRICE_COLUMNS]
+
+    last_time = buffer.last_time()
+    if last_time == start_time:
+        buffer.update_last(row)
+    elif last_time is None or start_time > last_time:
+        if last_time is not None:
+            # New bar opened: hand the closed bars to the worker
+            bar_queue.put((data['symbol'], buffer.view()))
+        buffer.append(start_time, row)
+
+def market_stream():
+    """Keep the candle WebSocket connected - runs in background"""
+    print("Market stream started")
+
+    while not stop_trading.is_set():
+        delta_client.subscribe_to_candles(
+            TRADING_PARAMS['symbols'],
+            [TRADING_PARAMS['timeframe']],
+            on_candle,
+            on_subscribed=reseed_buffers
+        )
+        time.sleep(5)  # Back off before reconnecting
+
+def restart_market_stream(client):
+    """Drop queued bars and close the stream so it reconnects with current settings"""
+    with bar_queue.mutex:
+        bar_queue.queue.clear()
+    client.close_stream()
+
 def trading_loop():
-    """Main trading loop - runs in background"""
+    """Main trading loop - runs its own event loop in the background thread"""
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run_trading())
+    finally:
+        loop.close()
+
+def next_bar_events(timeout):
+    """Wait for closed bars, then drain the queue (latest snapshot per symbol)"""
+    try:
+        symbol, candles = bar_queue.get(timeout=timeout)
+    except queue.Empty:
+        return {}
+
+    events = {symbol: candles}
+    while True:
+        try:
+            symbol, candles = bar_queue.get_nowait()
+        except queue.Empty:
+            return events
+        events[symbol] = candles
+
+async def run_trading():
+    """Evaluate symbols on bar close, fanning network calls out concurrently"""
     print("Trading loop started")
+    last_refresh = 0.0
+    client = delta_client
 
-    while not stop_trading.is_set():
-        if not bot_state['running']:
-            time.sleep(5)
-            continue
+    try:
+        while not stop_trading.is_set():
+            events = await asyncio.to_thread(next_bar_events, 5)
+
+            # Environment switched: release the old client's session on this loop
+            if client is not delta_client:
+                await client.close_async()
+                client = delta_client
+
+            if not bot_state['running']:
+                continue
+
+            try:
+                # Refresh account state once a minute
+                if time.time() - last_refresh >= 60:
+                    await asyncio.gather(refresh_balance(), update_open_trades())
+                    last_refresh = time.time()
+
+                if not events:
+                    continue
 
+                # Limit concurrent trades
+                if len(bot_state['open_trades']) >= RISK_PARAMS['max_open_trades']:
+                    continue
+
+                await process_bars(events)
+
+            except Exception as e:
+                print(f"Error in trading loop: {e}")
+    finally:
+        await client.close_async()
+
+async def refresh_balance():
+    """Fetch wallet balance into bot state"""
+    wallet = await delta_client.get_wallet_balance_async()
+    if wallet and 'result' in wallet:
+        bot_state['account_balance'] = float(wallet['result'][0]['balance'])
+
+def evaluate_signals(events):
+    """Run the strategy per new bar and the ML model once for all signals"""
+    evaluated = []  # (symbol, signal, ml_confidence)
+    pending = []    # (symbol, signal, features) awaiting ML
+
+    # Phase 1: cheapest gates first - already-seen bar, then the trade cap, then strategy
+    for symbol, (times, bars) in events.items():
         try:
-            # Limit concurrent trades
+            last_time = int(times[-1])
+            if last_bar_ts.get(symbol) == last_time:
+                continue
+
             if len(bot_state['open_trades']) >= RISK_PARAMS['max_open_trades']:
-                time.sleep(30)
+                break
+            last_bar_ts[symbol] = last_time
+
+            # Generate signal
+            signal = smc_strategy.generate_signal(times, bars, symbol)
+            if not signal:
                 continue
 
-            # Fetch wallet balance
-            wallet = delta_client.get_wallet_balance()
-            if wallet and 'result' in wallet:
-                bot_state['account_balance'] = float(wallet['result'][0]['balance'])
-
-            # Analyze each symbol
-            for symbol in TRADING_PARAMS['symbols']:
-                try:
-                    # Fetch candle data
-                    candles = delta_client.fetch_candles(
-                        symbol,
-                        resolution=TRADING_PARAMS['timeframe'].replace('m', ''),
-                        limit=200
-                    )
-
-                    if not candles:
-                        continue
-
-                    # Convert to DataFrame
-                    df = pd.DataFrame(candles, columns=['time', 'open', 'high', 'low', 'close', 'volume'])
-                    df = df.astype({'open': float, 'high': float, 'low': float, 'close': float, 'volume': float})
-
-                    # Generate signal
-                    signal = smc_strategy.generate_signal(df, symbol)
-
-                    if not signal:
-                        continue
-
-                    # Get ML prediction
-                    ml_features = ml_model.preprocess(df)
-                    ml_confidence = ml_model.predict(ml_features)
-
-                    # Combine signals
-                    combined_confidence = (signal['confidence'] + ml_confidence) / 2
-
-                    if combined_confidence < 0.65:
-                        continue
-
-                    # Calculate position
-                    position = smc_strategy.calculate_position(signal, bot_state['account_balance'])
-
-                    if not position:
-                        continue
-
-                    # Get product ID
-                    product_id = delta_client.get_product_id(symbol)
-                    if not product_id:
-                        continue
-
-                    # Place order
-                    order_result = delta_client.place_order(
-                        product_id=product_id,
-                        side=position['side'],
-                        size=position['position_size'],
-                        order_type='market_order'
-                    )
-
-                    if order_result and 'result' in order_result:
-                        trade = {
-                            'id': order_result['result']['id'],
-                            'symbol': symbol,
-                            'side': position['side'].upper(),
-                            'entry_price': position['entry_price'],
-                            'size': position['position_size'],
-                            'stop_loss': position['stop_loss'],
-                            'take_profit': position['take_profit'],
-                            'risk': position['risk_amount'],
-                            'potential_profit': position['potential_profit'],
-                            'pnl': 0.0,
-                            'status': 'OPEN',
-                            'opened_at': datetime.now().isoformat()
-                        }
-
-                        bot_state['open_trades'].append(trade)
-                        print(f"✅ Opened {trade['side']} trade on {symbol}")
-
-                except Exception as e:
-                    print(f"Error processing {symbol}: {e}")
-
-            # Update open trades
-            update_open_trades()
+            ml_features = ml_model.preprocess(bars)
+            if ml_features is None:
+                evaluated.append((symbol, signal, 0.5))
+                continue
+
+            pending.append((symbol, signal, ml_features))
 
         except Exception as e:
-            print(f"Error in trading loop: {e}")
+            print(f"Error processing {symbol}: {e}")
+
+    # Phase 2: one forward pass for every symbol with a signal
+    if pending:
+        confidences = ml_model.predict_batch(np.stack([features for *_, features in pending]))
+        for (symbol, signal, _), ml_confidence in zip(pending, confidences):
+            evaluated.append((symbol, signal, float(ml_confidence)))
+
+    return evaluated
 
-        time.sleep(60)  # Wait 1 minute before next iteration
+async def process_bars(events):
+    """Evaluate closed bars for all symbols, then open trades concurrently"""
+    positions = []
 
-def update_open_trades():
+    for symbol, signal, ml_confidence in evaluate_signals(events):
+        # Count orders queued in this batch so the cap holds while they are in flight
+        if len(bot_state['open_trades']) + len(positions) >= RISK_PARAMS['max_open_trades']:
+            break
+
+        # Combine signals
+        combined_confidence = (signal['confidence'] + ml_confidence) / 2
+
+        if combined_confidence < 0.65:
+            continue
+
+        # Calculate position
+        position = smc_strategy.calculate_position(signal, bot_state['account_balance'])
+
+        if position:
+            positions.append((symbol, position))
+
+    await asyncio.gather(*(open_trade(symbol, position) for symbol, position in positions))
+
+async def open_trade(symbol, position):
+    """Place the order for a sized position and record the trade"""
+    try:
+        # Get product ID (blocking on a cache miss, so keep it off the event loop)
+        product_id = await asyncio.to_thread(delta_client.get_product_id, symbol)
+        if not product_id:
+            return
+
+        # Place order
+        order_result = await delta_client.place_order_async(
+            product_id=product_id,
+            side=position['side'],
+            size=position['position_size'],
+            order_type='market_order'
+        )
+
+        if order_result and 'result' in order_result:
+            trade = {
+                'id': order_result['result']['id'],
+                'symbol': symbol,
+                'side': position['side'].upper(),
+                'entry_price': position['entry_price'],
+                'size': position['position_size'],
+                'stop_loss': position['stop_loss'],
+                'take_profit': position['take_profit'],
+                'risk': position['risk_amount'],
+                'potential_profit': position['potential_profit'],
+                'pnl': 0.0,
+                'status': 'OPEN',
+                'opened_at': datetime.now().isoformat()
+            }
+
+            with state_lock:
+                bot_state['open_trades'] = bot_state['open_trades'] + [trade]
+            print(f"✅ Opened {trade['side']} trade on {symbol}")
+
+    except Exception as e:
+        print(f"Error opening trade on {symbol}: {e}")
+
+async def update_open_trades():
     """Update status and PnL of open trades"""
-    positions = delta_client.get_positions()
+    positions = await delta_client.get_positions_async()
 
     if not positions or 'result' not in positions:
         return
 
-    for trade in bot_state['open_trades'][:]:
+    by_symbol = {pos['product_symbol']: pos for pos in positions['result']}
+    closing = set()  # id() of trades whose position is now flat
+
+    with state_lock:
+        open_snap = bot_state['open_trades']
+
+    for trade in open_snap:
         try:
-            # Find matching position
-            matching_pos = None
-            for pos in positions['result']:
-                if pos['product_symbol'] == trade['symbol']:
-                    matching_pos = pos
-                    break
+            matching_pos = by_symbol.get(trade['symbol'])
 
             if matching_pos:
                 # Update PnL
@@ -159,38 +315,56 @@ def update_open_trades():
 
                 # Check if closed
                 if float(matching_pos.get('size', 0)) == 0:
-                    trade['status'] = 'CLOSED'
-                    trade['closed_at'] = datetime.now().isoformat()
+                    closing.add(id(trade))
+
+        except Exception as e:
+            print(f"Error updating trade: {e}")
 
-                    bot_state['open_trades'].remove(trade)
-                    bot_state['closed_trades'].append(trade)
-                    bot_state['total_pnl'] += trade['pnl']
+    if not closing:
+        return
 
-                    if trade['pnl'] > 0:
-                        bot_state['win_count'] += 1
-                    else:
-                        bot_state['loss_count'] += 1
+    closed_at = datetime.now().isoformat()
+    with state_lock:
+        still_open = []
+        for trade in bot_state['open_trades']:
+            if id(trade) not in closing:
+                still_open.append(trade)
+                continue
 
-                    print(f"✅ Closed trade on {trade['symbol']}: PnL = ${trade['pnl']:.2f}")
+            # Copy so a reader serializing the open trade never sees it change shape
+            closed = dict(trade, status='CLOSED', closed_at=closed_at)
+            bot_state['closed_trades'].append(closed)
+            bot_state['total_pnl'] += closed['pnl']
 
-        except Exception as e:
-            print(f"Error updating trade: {e}")
+            if closed['pnl'] > 0:
+                bot_state['win_count'] += 1
+            else:
+                bot_state['loss_count'] += 1
+
+            print(f"✅ Closed trade on {closed['symbol']}: PnL = ${closed['pnl']:.2f}")
+
+        bot_state['open_trades'] = still_open
 
 # API Routes
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get bot status"""
-    total_trades = bot_state['win_count'] + bot_state['loss_count']
-    win_rate = (bot_state['win_count'] / total_trades) if total_trades > 0 else 0.0
+    with state_lock:
+        win_count = bot_state['win_count']
+        total_trades = win_count + bot_state['loss_count']
+        open_count = len(bot_state['open_trades'])
+        total_pnl = bot_state['total_pnl']
+
+    win_rate = (win_count / total_trades) if total_trades > 0 else 0.0
 
     return jsonify({
         'running': bot_state['running'],
         'environment': bot_state['environment'],
         'account_balance': bot_state['account_balance'],
-        'open_trades': len(bot_state['open_trades']),
+        'open_trades': open_count,
         'total_trades': total_trades,
-        'total_pnl': bot_state['total_pnl'],
+        'total_pnl': total_pnl,
         'win_rate': win_rate,
         'last_update': datetime.now().isoformat()
     })
@@ -217,7 +391,11 @@ def switch_environment():
         bot_state['environment'] = env
         # Reinitialize client with new environment
         global delta_client
+        old_client = delta_client
         delta_client = DeltaExchangeClient()
+
+        # Candles must come from the new environment too
+        restart_market_stream(old_client)
         return jsonify({'environment': env, 'status': 'Environment switched'})
 
     return jsonify({'error': 'Invalid environment'}), 400
@@ -225,15 +403,22 @@ def switch_environment():
 @app.route('/api/trades', methods=['GET'])
 def get_trades():
     """Get all trades"""
+    with state_lock:
+        open_snap = bot_state['open_trades']
+        closed_snap = list(islice(reversed(bot_state['closed_trades']), 50))[::-1]  # Last 50
+
     return jsonify({
-        'open_trades': bot_state['open_trades'],
-        'closed_trades': bot_state['closed_trades'][-50:]  # Last 50
+        'open_trades': open_snap,
+        'closed_trades': closed_snap
     })
 
 @app.route('/api/trades/close/<trade_id>', methods=['POST'])
 def close_trade(trade_id):
     """Manually close a trade"""
-    for trade in bot_state['open_trades']:
+    with state_lock:
+        open_snap = bot_state['open_trades']
+
+    for trade in open_snap:
         if str(trade['id']) == trade_id:
             try:
                 product_id = delta_client.get_product_id(trade['symbol'])
@@ -271,8 +456,13 @@ def update_parameters():
         RISK_PARAMS.update(data['risk'])
 
     if 'trading' in data:
+        stream_params = (list(TRADING_PARAMS['symbols']), TRADING_PARAMS['timeframe'])
         TRADING_PARAMS.update(data['trading'])
 
+        # Resubscribe (and reseed) when the streamed symbols or timeframe change
+        if stream_params != (list(TRADING_PARAMS['symbols']), TRADING_PARAMS['timeframe']):
+            restart_market_stream(delta_client)
+
     return jsonify({
         'status': 'Parameters updated',
         'risk': RISK_PARAMS,
@@ -284,11 +474,23 @@ def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
 
-if __name__ == '__main__':
-    # Start trading loop in background
+def start_background_tasks():
+    """Start market stream (which backfills history on connect) and trading loop in background"""
+    global trading_thread, stream_thread
+
+    if trading_thread is not None:
+        return
+
+    stream_thread = threading.Thread(target=market_stream, daemon=True)
+    stream_thread.start()
+
     trading_thread = threading.Thread(target=trading_loop, daemon=True)
     trading_thread.start()
 
+if __name__ == '__main__':
+    # Local development only - production runs under gunicorn via wsgi.py
+    start_background_tasks()
+
     # Start Flask app
     print("🚀 SMC Trading Bot starting...")
     print(f"📊 Environment: {ENVIRONMENT_MODE}")
@@ -0,0 +1,45 @@
+import numpy as np
+
+# Column layout of the float32 price arrays passed to the strategy and ML model;
+# bar open times are kept separately as int64 so they stay exact
+O, H, L, C, V = range(5)
+
+class CandleBuffer:
+    """Fixed-capacity ring buffer of OHLCV bars (int64 open times + float32 open, high, low, close, volume)"""
+
+    def __init__(self, cap=512):
+        self.t = np.empty(cap, dtype=np.int64)
+        self.a = np.empty((cap, 5), dtype=np.float32)
+        self.n = 0
+        self.cap = cap
+
+    def __len__(self):
+        return min(self.n, self.cap)
+
+    def append(self, time, row):
+        """Add a new bar, overwriting the oldest once full"""
+        i = self.n % self.cap
+        self.t[i] = time
+        self.a[i] = row
+        self.n += 1
+
+    def update_last(self, row):
+        """Replace the prices of the most recent (still forming) bar"""
+        self.a[(self.n - 1) % self.cap] = row
+
+    def last_time(self):
+        """Open time of the most recent bar, or None if empty"""
+        if self.n == 0:
+            return None
+        return int(self.t[(self.n - 1) % self.cap])
+
+    def view(self):
+        """Copies of (times, bars) in chronological order"""
+        if self.n <= self.cap:
+            return self.t[:self.n].copy(), self.a[:self.n].copy()
+
+        start = self.n % self.cap
+        return (
+            np.concatenate((self.t[start:], self.t[:start])),
+            np.concatenate((self.a[start:], self.a[:start]))
+        )
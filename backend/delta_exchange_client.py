@@ -1,12 +1,19 @@
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import websocket
 import json
 import hmac
 import hashlib
+import threading
+import time
 from datetime import datetime
 import asyncio
 from config import get_config
 
+PRODUCT_CACHE_TTL = 3600  # Seconds before the symbol -> product ID map is refreshed
+
 class DeltaExchangeClient:
     def __init__(self):
         self.config = get_config()
@@ -15,6 +22,23 @@ class DeltaExchangeClient:
         self.api_key = self.config['api_key']
         self.api_secret = self.config['api_secret']
         self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=20,
+            pool_maxsize=20,
+            max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+        )
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Connection': 'keep-alive'})
+        self._hmac = hmac.new((self.api_secret or '').encode(), digestmod=hashlib.sha256)
+        # Static part of the auth headers; only signature and timestamp change per request
+        self._base_headers = {'Content-Type': 'application/json'}
+        if self.api_key:
+            self._base_headers['X-API-KEY'] = self.api_key
+        self._product_id_cache = {}
+        self._product_cache_ts = 0
+        self._product_lock = threading.Lock()
+        self._async_sessions = {}  # Event loop -> aiohttp session owned by that loop
+        self._ws = None  # Active candle stream, if any
 
     def _sign_request(self, method, endpoint, params=None):
         """Sign request with API key and secret"""
@@ -26,18 +50,13 @@ class DeltaExchangeClient:
         else:
             message = f"{method}{endpoint}{json.dumps(params or {})}{timestamp}"
 
-        signature = hmac.new(
-            self.api_secret.encode(),
-            message.encode(),
-            hashlib.sha256
-        ).hexdigest()
-
-        headers = {
-            'X-API-KEY': self.api_key,
-            'X-SIGNATURE': signature,
-            'X-TIMESTAMP': timestamp,
-            'Content-Type': 'application/json'
-        }
+        mac = self._hmac.copy()
+        mac.update(message.encode())
+        signature = mac.hexdigest()
+
+        headers = self._base_headers.copy()
+        headers['X-SIGNATURE'] = signature
+        headers['X-TIMESTAMP'] = timestamp
         return headers
 
     def fetch_candles(self, symbol, resolution='15', limit=500):
@@ -146,23 +165,119 @@ class DeltaExchangeClient:
             return None
 
     def get_product_id(self, symbol):
-        """Get product ID for symbol"""
-        endpoint = '/v2/products'
-        headers = self._sign_request('GET', endpoint)
+        """Get product ID for symbol (cached for PRODUCT_CACHE_TTL seconds)"""
+        with self._product_lock:
+            if time.time() - self._product_cache_ts < PRODUCT_CACHE_TTL and symbol in self._product_id_cache:
+                return self._product_id_cache[symbol]
 
-        try:
-            response = self.session.get(
-                f"{self.base_url}{endpoint}",
-                headers=headers,
-                timeout=10
+            endpoint = '/v2/products'
+            headers = self._sign_request('GET', endpoint)
+
+            try:
+                response = self.session.get(
+                    f"{self.base_url}{endpoint}",
+                    headers=headers,
+                    timeout=10
+                )
+                products = response.json().get('result', [])
+                product_ids = {product['symbol']: product['id'] for product in products}
+                if product_ids:
+                    self._product_id_cache = product_ids
+                    self._product_cache_ts = time.time()
+                return product_ids.get(symbol)
+            except Exception as e:
+                print(f"Error getting product ID: {e}")
+                return None
+
+    def _get_async_session(self):
+        """Lazily create the aiohttp session for the running event loop"""
+        loop = asyncio.get_running_loop()
+        session = self._async_sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=10)
             )
-            products = response.json().get('result', [])
-            for product in products:
-                if product['symbol'] == symbol:
-                    return product['id']
+            self._async_sessions[loop] = session
+        return session
+
+    async def close_async(self):
+        """Close the aiohttp session owned by the running event loop"""
+        session = self._async_sessions.pop(asyncio.get_running_loop(), None)
+        if session is not None and not session.closed:
+            await session.close()
+
+    async def _request_async(self, method, endpoint, params=None):
+        """Send a signed request and return (status, parsed JSON)"""
+        headers = self._sign_request(method, endpoint, params)
+        session = self._get_async_session()
+
+        async with session.request(
+            method,
+            f"{self.base_url}{endpoint}",
+            params=params if method == 'GET' else None,
+            json=params if method != 'GET' else None,
+            headers=headers
+        ) as response:
+            return response.status, await response.json(content_type=None)
+
+    async def fetch_candles_async(self, symbol, resolution='15', limit=500):
+        """Fetch historical OHLCV data (async)"""
+        params = {
+            'symbol': symbol,
+            'resolution': resolution,
+            'limit': limit
+        }
+
+        try:
+            status, data = await self._request_async('GET', '/v2/history/candles', params)
+            if status == 200:
+                return data.get('result', [])
+            return None
+        except Exception as e:
+            print(f"Error fetching candles: {e}")
             return None
+
+    async def get_wallet_balance_async(self):
+        """Fetch account balance (async)"""
+        try:
+            status, data = await self._request_async('GET', '/v2/wallet/balances')
+            if status == 200:
+                # For testnet, return mock balance if no real balance
+                if not data.get('result') or len(data['result']) == 0:
+                    return {'result': [{'balance': '10000.0'}]}
+                return data
+            return {'result': [{'balance': '10000.0'}]}  # Fallback for testnet
+        except Exception as e:
+            print(f"Error fetching wallet balance: {e}")
+            return {'result': [{'balance': '10000.0'}]}  # Fallback
+
+    async def get_positions_async(self):
+        """Get all open positions (async)"""
+        try:
+            _, data = await self._request_async('GET', '/v2/positions')
+            return data
         except Exception as e:
-            print(f"Error getting product ID: {e}")
+            print(f"Error fetching positions: {e}")
+            return None
+
+    async def place_order_async(self, product_id, side, size, order_type='market_order', price=None):
+        """Place a new order (async)"""
+        params = {
+            'product_id': product_id,
+            'side': side,
+            'size': size,
+            'order_type': order_type
+        }
+
+        if order_type == 'limit_order' and price:
+            params['price'] = price
+
+        try:
+            _, data = await self._request_async('POST', '/v2/orders', params)
+            return data
+        except Exception as e:
+            print(f"Error placing order: {e}")
             return None
 
     async def subscribe_to_ticker(self, symbol, callback):
@@ -194,4 +309,54 @@ class DeltaExchangeClient:
             )
             ws.run_forever()
         except Exception as e:
-            print(f"Error in WebSocket subscription: {e}")
\ No newline at end of file
+            print(f"Error in WebSocket subscription: {e}")
+
+    def subscribe_to_candles(self, symbols, resolutions, callback, on_subscribed=None):
+        """Stream OHLCV candle updates via WebSocket (blocks until closed)"""
+        try:
+            def on_message(ws, message):
+                data = json.loads(message)
+                if data.get('type', '').startswith('candlestick_'):
+                    callback(data)
+
+            def on_error(ws, error):
+                print(f"WebSocket error: {error}")
+
+            def on_close(ws, close_status_code, close_msg):
+                print("Candle stream closed")
+
+            def on_open(ws):
+                subscribe_msg = {
+                    'type': 'subscribe',
+                    'payload': {
+                        'channels': [
+                            {'name': f'candlestick_{resolution}', 'symbols': list(symbols)}
+                            for resolution in resolutions
+                        ]
+                    }
+                }
+                ws.send(json.dumps(subscribe_msg))
+
+                # Updates arriving meanwhile are buffered until this returns
+                if on_subscribed:
+                    on_subscribed()
+
+            ws = websocket.WebSocketApp(
+                self.ws_url,
+                on_message=on_message,
+                on_error=on_error,
+                on_close=on_close,
+                on_open=on_open
+            )
+            self._ws = ws
+            ws.run_forever(ping_interval=30, ping_timeout=10)
+        except Exception as e:
+            print(f"Error in candle stream: {e}")
+        finally:
+            self._ws = None
+
+    def close_stream(self):
+        """Close the active candle stream, making subscribe_to_candles return"""
+        ws = self._ws
+        if ws is not None:
+            ws.close()
\ No newline at end of file
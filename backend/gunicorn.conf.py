@@ -0,0 +1,15 @@
+# Gunicorn settings for the backend API
+bind = '0.0.0.0:5000'
+
+# Bot state and the trading loop live in-process, so run exactly one worker;
+# its thread pool serves the dashboard's concurrent requests.
+workers = 1
+worker_class = 'gthread'
+threads = 8
+
+# Don't preload: background threads must start inside the worker, not the master
+preload_app = False
+
+timeout = 60
+accesslog = '-'
+errorlog = '-'
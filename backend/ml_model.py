@@ -1,14 +1,25 @@
 import numpy as np
-import pandas as pd
+import talib
+import tensorflow as tf
 from tensorflow.keras.models import Sequential, load_model
 from tensorflow.keras.layers import Dense, Dropout, LSTM
 from tensorflow.keras.optimizers import Adam
 import os
+from candle_buffer import H, L, C
+
+FEATURE_WINDOW = 30
+FEATURE_LOOKBACK = 64  # MACD(12, 26, 9) warmup plus the feature window
 
 class MLModel:
-    def __init__(self, model_path='models/smc_model.h5'):
+    def __init__(self, model_path='models/smc_model.h5', max_batch=2):
         self.model_path = model_path
+        # Batches are zero-padded to this size so XLA compiles a single batch shape
+        self.max_batch = max(max_batch, 2)
         self.model = None
+        self.interpreter = None
+        self._input_index = None
+        self._output_index = None
+        self._infer = None
         self.load_or_create_model()
 
     def load_or_create_model(self):
@@ -23,6 +34,43 @@ class MLModel:
         else:
             self.create_model()
 
+        self._build_infer()
+        self._build_interpreter()
+
+    def _build_infer(self):
+        """Trace a fixed-window forward pass (any batch size), XLA-compiled where supported"""
+        model = self.model
+        signature = [tf.TensorSpec((None, 30, 5), tf.float32)]
+
+        try:
+            self._infer = tf.function(
+                lambda x: model(x, training=False),
+                input_signature=signature,
+                jit_compile=True
+            )
+            # Warm the trace and compile cache for both shapes used live
+            self._infer(tf.zeros((1, 30, 5), tf.float32))
+            self._infer(tf.zeros((self.max_batch, 30, 5), tf.float32))
+        except Exception as e:
+            print(f"XLA compilation failed, using plain tf.function: {e}")
+            self._infer = tf.function(lambda x: model(x, training=False), input_signature=signature)
+
+    def _build_interpreter(self):
+        """Compile the Keras model to a TFLite interpreter for single-sample inference"""
+        try:
+            converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+            converter.target_spec.supported_ops = [
+                tf.lite.OpsSet.TFLITE_BUILTINS,
+                tf.lite.OpsSet.SELECT_TF_OPS
+            ]
+            self.interpreter = tf.lite.Interpreter(model_content=converter.convert())
+            self.interpreter.allocate_tensors()
+            self._input_index = self.interpreter.get_input_details()[0]['index']
+            self._output_index = self.interpreter.get_output_details()[0]['index']
+        except Exception as e:
+            print(f"TFLite conversion failed, falling back to tf.function: {e}")
+            self.interpreter = None
+
     def create_model(self):
         """Create a new ML model for price prediction"""
         self.model = Sequential([
@@ -41,29 +89,37 @@ class MLModel:
         )
         print("Created new ML model")
 
-    def preprocess(self, df):
-        """Convert raw OHLCV to ML features"""
-        if df is None or len(df) < 30:
+    def preprocess(self, bars):
+        """Convert raw OHLCV bars (candle_buffer column layout) to ML features"""
+        if bars is None or len(bars) < FEATURE_WINDOW:
             return None
 
-        df = df.copy()
+        # Only the bars that feed the last FEATURE_WINDOW rows are touched;
+        # TA-Lib only takes float64, so this short window is upcast
+        tail = bars[-FEATURE_LOOKBACK:]
+        close = np.ascontiguousarray(tail[:, C], dtype=np.float64)
+        high = np.ascontiguousarray(tail[:, H], dtype=np.float64)
+        low = np.ascontiguousarray(tail[:, L], dtype=np.float64)
 
-        # Add technical features
-        df['returns'] = df['close'].pct_change()
-        df['volatility'] = df['returns'].rolling(20).std()
-        df['rsi'] = self._calculate_rsi(df['close'], 14)
-        df['macd'] = self._calculate_macd(df['close'])
-        df['atr'] = self._calculate_atr(df)
+        returns = np.empty_like(close)
+        returns[0] = np.nan
+        returns[1:] = close[1:] / close[:-1] - 1
 
-        # Select features
-        features = df[['returns', 'volatility', 'rsi', 'macd', 'atr']].tail(30).values
+        features = np.empty((FEATURE_WINDOW, 5), dtype=np.float32)
+        features[:, 0] = returns[-FEATURE_WINDOW:]
+        features[:, 1] = self._rolling_std(returns, 20)[-FEATURE_WINDOW:]
+        features[:, 2] = self._calculate_rsi(close, 14)[-FEATURE_WINDOW:]
+        features[:, 3] = self._calculate_macd(close)[-FEATURE_WINDOW:]
+        features[:, 4] = self._calculate_atr(high, low, close)[-FEATURE_WINDOW:]
 
         # Handle NaN values
-        features = np.nan_to_num(features, nan=0.0)
+        np.nan_to_num(features, copy=False, nan=0.0)
 
         # Normalize features
-        if features.std(axis=0).any():
-            features = (features - features.mean(axis=0)) / (features.std(axis=0) + 1e-8)
+        std = features.std(axis=0)
+        if std.any():
+            features -= features.mean(axis=0)
+            features /= std + 1e-8
 
         return features
 
@@ -73,12 +129,41 @@ class MLModel:
             return 0.5
 
         try:
-            prediction = self.model.predict(features.reshape(1, 30, 5), verbose=0)[0][0]
-            return float(prediction)
+            if self.interpreter is not None:
+                self.interpreter.set_tensor(self._input_index, np.asarray(features, dtype=np.float32).reshape(1, 30, 5))
+                self.interpreter.invoke()
+                return float(self.interpreter.get_tensor(self._output_index)[0, 0])
+
+            prediction = self._infer(tf.constant(np.asarray(features, dtype=np.float32).reshape(1, 30, 5)))
+            return float(prediction.numpy()[0, 0])
         except Exception as e:
             print(f"Prediction error: {e}")
             return 0.5
 
+    def predict_batch(self, features):
+        """Generate predictions (0-1 confidence) for a (k, 30, 5) batch in one forward pass"""
+        if self.model is None or len(features) == 0:
+            return np.full(len(features), 0.5)
+
+        # A single sample is cheapest through the TFLite interpreter
+        if len(features) == 1:
+            return np.array([self.predict(features[0])])
+
+        try:
+            k = len(features)
+            padded = np.zeros((-(-k // self.max_batch) * self.max_batch, 30, 5), dtype=np.float32)
+            padded[:k] = features
+
+            # Every forward pass uses the warmed (max_batch, 30, 5) shape
+            predictions = np.concatenate([
+                self._infer(tf.constant(padded[i:i + self.max_batch]))[:, 0].numpy()
+                for i in range(0, len(padded), self.max_batch)
+            ])
+            return predictions[:k].astype(np.float64)
+        except Exception as e:
+            print(f"Batch prediction error: {e}")
+            return np.full(len(features), 0.5)
+
     def save_model(self):
         """Save model to disk"""
         if self.model:
@@ -87,39 +172,27 @@ class MLModel:
             print(f"Model saved to {self.model_path}")
 
     @staticmethod
-    def _calculate_rsi(prices, period=14):
-        """Calculate RSI"""
-        if len(prices) < period + 1:
-            return pd.Series([50.0] * len(prices), index=prices.index)
+    def _rolling_std(values, window):
+        """Sample standard deviation over a trailing window (NaN until full)"""
+        out = np.full(len(values), np.nan)
+        if len(values) >= window:
+            out[window - 1:] = np.lib.stride_tricks.sliding_window_view(values, window).std(axis=1, ddof=1)
+        return out
 
-        deltas = prices.diff()
-        gain = (deltas.where(deltas > 0, 0)).rolling(window=period).mean()
-        loss = (-deltas.where(deltas < 0, 0)).rolling(window=period).mean()
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        return rsi.fillna(50.0)
+    @staticmethod
+    def _calculate_rsi(close, period=14):
+        """Calculate RSI"""
+        rsi = talib.RSI(close, timeperiod=period)
+        return np.nan_to_num(rsi, nan=50.0)
 
     @staticmethod
-    def _calculate_macd(prices, fast=12, slow=26, signal=9):
+    def _calculate_macd(close, fast=12, slow=26, signal=9):
         """Calculate MACD"""
-        if len(prices) < slow:
-            return pd.Series([0.0] * len(prices), index=prices.index)
-
-        ema_fast = prices.ewm(span=fast).mean()
-        ema_slow = prices.ewm(span=slow).mean()
-        macd = ema_fast - ema_slow
-        return macd.fillna(0.0)
+        macd, _, _ = talib.MACD(close, fastperiod=fast, slowperiod=slow, signalperiod=signal)
+        return np.nan_to_num(macd, nan=0.0)
 
     @staticmethod
-    def _calculate_atr(df, period=14):
+    def _calculate_atr(high, low, close, period=14):
         """Calculate ATR"""
-        if len(df) < period:
-            return pd.Series([0.0] * len(df), index=df.index)
-
-        high_low = df['high'] - df['low']
-        high_close = (df['high'] - df['close'].shift()).abs()
-        low_close = (df['low'] - df['close'].shift()).abs()
-
-        tr = pd.concat([high_low, high_close, low_close], axis=1).max(axis=1)
-        atr = tr.rolling(period).mean()
-        return atr.fillna(0.0)
\ No newline at end of file
+        atr = talib.ATR(high, low, close, timeperiod=period)
+        return np.nan_to_num(atr, nan=0.0)
\ No newline at end of file
@@ -1,110 +1,137 @@
-import pandas as pd
 import numpy as np
 from config import RISK_PARAMS
+from candle_buffer import O, H, L, C
+from _njit import njit
+
+# Record layouts returned by the pattern detectors
+OB_DTYPE = np.dtype([('type', 'U8'), ('high', 'f8'), ('low', 'f8'), ('time', 'i8'), ('confirmed', '?')])
+ENGULFING_DTYPE = np.dtype([('type', 'U17'), ('time', 'i8'), ('strength', 'f8')])
+
+@njit(cache=True)
+def _choch_scan(high, low, window):
+    """Return indices and directions (1 bull / -1 bear) of bars breaking the prior window's range"""
+    n = high.shape[0]
+    idx = np.empty(n, np.int64)
+    kinds = np.empty(n, np.int8)
+    k = 0
+
+    # Monotonic deques of bar indices (head/tail pointers into flat arrays):
+    # highs decreasing and lows increasing, so each front is the window's extreme
+    max_q = np.empty(n, np.int64)
+    min_q = np.empty(n, np.int64)
+    max_head = max_tail = 0
+    min_head = min_tail = 0
+
+    for i in range(n):
+        if i >= 2:
+            while max_q[max_head] < i - window:
+                max_head += 1
+            while min_q[min_head] < i - window:
+                min_head += 1
+
+            if high[i] > high[max_q[max_head]]:
+                idx[k] = i
+                kinds[k] = 1
+                k += 1
+            elif low[i] < low[min_q[min_head]]:
+                idx[k] = i
+                kinds[k] = -1
+                k += 1
+
+        while max_tail > max_head and high[max_q[max_tail - 1]] <= high[i]:
+            max_tail -= 1
+        max_q[max_tail] = i
+        max_tail += 1
+
+        while min_tail > min_head and low[min_q[min_tail - 1]] >= low[i]:
+            min_tail -= 1
+        min_q[min_tail] = i
+        min_tail += 1
+
+    return idx[:k], kinds[:k]
 
 class SMCStrategy:
     def __init__(self, risk_params):
         self.risk_params = risk_params
         self.open_trades = {}
 
-    def detect_order_blocks(self, df, lookback=50):
+    def detect_order_blocks(self, times, bars, lookback=50):
         """Identify order blocks (supply/demand zones)"""
-        order_blocks = []
-
-        for i in range(lookback, len(df)):
-            # Bullish order block: strong candle followed by down move
-            if (df['close'].iloc[i] > df['open'].iloc[i] and
-                i+1 < len(df) and df['close'].iloc[i+1] < df['open'].iloc[i+1]):
-                order_blocks.append({
-                    'type': 'BULLISH',
-                    'high': df['high'].iloc[i],
-                    'low': df['low'].iloc[i],
-                    'time': df['time'].iloc[i],
-                    'confirmed': False
-                })
-
-            # Bearish order block: strong down candle followed by up move
-            if (df['close'].iloc[i] < df['open'].iloc[i] and
-                i+1 < len(df) and df['close'].iloc[i+1] > df['open'].iloc[i+1]):
-                order_blocks.append({
-                    'type': 'BEARISH',
-                    'high': df['high'].iloc[i],
-                    'low': df['low'].iloc[i],
-                    'time': df['time'].iloc[i],
-                    'confirmed': False
-                })
-
+        o, h, l, c = (bars[:, col] for col in (O, H, L, C))
+        up = c > o
+        down = c < o
+
+        # Bullish order block: strong candle followed by down move
+        # Bearish order block: strong down candle followed by up move
+        bull = up[lookback:-1] & down[lookback + 1:]
+        bear = down[lookback:-1] & up[lookback + 1:]
+
+        # Records stay in bar order so [-1] is the most recent block
+        hits = np.flatnonzero(bull | bear)
+        idx = hits + lookback
+        order_blocks = np.zeros(hits.size, dtype=OB_DTYPE)
+        order_blocks['type'] = np.where(bull[hits], 'BULLISH', 'BEARISH')
+        order_blocks['high'] = h[idx]
+        order_blocks['low'] = l[idx]
+        order_blocks['time'] = times[idx]
         return order_blocks
 
-    def detect_choch(self, df):
+    def detect_choch(self, times, bars):
         """Detect Change of Character (market structure breaks)"""
-        choch_points = []
-
-        # Simple CHoCH: break of recent high or low
-        for i in range(2, len(df)):
-            recent_high = df['high'].iloc[max(0, i-20):i].max()
-            recent_low = df['low'].iloc[max(0, i-20):i].min()
-
-            if df['high'].iloc[i] > recent_high:
-                choch_points.append({
-                    'type': 'BULLISH_CHOCH',
-                    'price': df['high'].iloc[i],
-                    'time': df['time'].iloc[i]
-                })
-            elif df['low'].iloc[i] < recent_low:
-                choch_points.append({
-                    'type': 'BEARISH_CHOCH',
-                    'price': df['low'].iloc[i],
-                    'time': df['time'].iloc[i]
-                })
-
-        return choch_points
-
-    def detect_engulfing(self, df):
+        high = bars[:, H]
+        low = bars[:, L]
+
+        # Simple CHoCH: break of the high/low of the previous 20 bars
+        idx, kinds = _choch_scan(high, low, 20)
+
+        return [
+            {
+                'type': 'BULLISH_CHOCH',
+                'price': high[i],
+                'time': times[i]
+            } if kind > 0 else {
+                'type': 'BEARISH_CHOCH',
+                'price': low[i],
+                'time': times[i]
+            }
+            for i, kind in zip(idx, kinds)
+        ]
+
+    def detect_engulfing(self, times, bars):
         """Detect engulfing candlestick patterns"""
-        engulfing_patterns = []
-
-        for i in range(1, len(df)):
-            prev_open = df['open'].iloc[i-1]
-            prev_close = df['close'].iloc[i-1]
-            curr_open = df['open'].iloc[i]
-            curr_close = df['close'].iloc[i]
-
-            # Bullish engulfing
-            if (prev_close < prev_open and
-                curr_close > prev_open and
-                curr_open < prev_close):
-                engulfing_patterns.append({
-                    'type': 'BULLISH_ENGULFING',
-                    'time': df['time'].iloc[i],
-                    'strength': (curr_close - curr_open) / (prev_close - prev_open)
-                })
-
-            # Bearish engulfing
-            if (prev_close > prev_open and
-                curr_close < prev_open and
-                curr_open > prev_close):
-                engulfing_patterns.append({
-                    'type': 'BEARISH_ENGULFING',
-                    'time': df['time'].iloc[i],
-                    'strength': (curr_open - curr_close) / (curr_open - prev_open)
-                })
-
-        return engulfing_patterns
-
-    def generate_signal(self, df, symbol):
-        """Generate trading signal combining SMC components"""
+        o = bars[:, O]
+        c = bars[:, C]
+        prev_open, prev_close = o[:-1], c[:-1]
+        curr_open, curr_close = o[1:], c[1:]
+
+        bull = (prev_close < prev_open) & (curr_close > prev_open) & (curr_open < prev_close)
+        bear = (prev_close > prev_open) & (curr_close < prev_open) & (curr_open > prev_close)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bull_strength = (curr_close - curr_open) / (prev_close - prev_open)
+            bear_strength = (curr_open - curr_close) / (curr_open - prev_open)
+
+        hits = np.flatnonzero(bull | bear)
+        is_bull = bull[hits]
+        engulfing = np.zeros(hits.size, dtype=ENGULFING_DTYPE)
+        engulfing['type'] = np.where(is_bull, 'BULLISH_ENGULFING', 'BEARISH_ENGULFING')
+        engulfing['time'] = times[hits + 1]
+        engulfing['strength'] = np.where(is_bull, bull_strength[hits], bear_strength[hits])
+        return engulfing
+
+    def generate_signal(self, times, bars, symbol):
+        """Generate trading signal combining SMC components (bars: candle_buffer column layout)"""
         # Get SMC components
-        order_blocks = self.detect_order_blocks(df)
-        choch = self.detect_choch(df)
-        engulfing = self.detect_engulfing(df)
+        order_blocks = self.detect_order_blocks(times, bars)
+        choch = self.detect_choch(times, bars)
+        engulfing = self.detect_engulfing(times, bars)
 
         # Simple signal generation logic
         signal_strength = 0
         direction = 'NEUTRAL'
 
         # Order blocks contribute to signal
-        if order_blocks:
+        if len(order_blocks):
             latest_ob = order_blocks[-1]
             if latest_ob['type'] == 'BULLISH':
                 signal_strength += 0.4
@@ -126,7 +153,7 @@ class SMCStrategy:
                     direction = 'SELL'
 
         # Engulfing contributes to signal
-        if engulfing:
+        if len(engulfing):
             latest_engulfing = engulfing[-1]
             if latest_engulfing['type'] == 'BULLISH_ENGULFING':
                 signal_strength += 0.3
@@ -143,10 +170,10 @@ class SMCStrategy:
                 'symbol': symbol,
                 'direction': direction,
                 'confidence': min(signal_strength, 1.0),
-                'order_blocks': order_blocks[-3:] if order_blocks else [],
+                'order_blocks': order_blocks[-3:],
                 'choch': choch[-1] if choch else None,
-                'engulfing': engulfing[-1] if engulfing else None,
-                'timestamp': df['time'].iloc[-1] if len(df) > 0 else None
+                'engulfing': engulfing[-1] if len(engulfing) else None,
+                'timestamp': times[-1] if len(times) > 0 else None
             }
 
         return None
@@ -0,0 +1,5 @@
+"""Production entrypoint: gunicorn -c gunicorn.conf.py wsgi:app"""
+from app import app, start_background_tasks
+
+# The worker that imports the app owns the trading loop and bot state
+start_background_tasks()